@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import io
+import random
+import time
+
+import png
+
+
+def timeit(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def bench_unfilter(args):
+    """Time each reverse-filter kernel of every engine
+    on `args.rows` random scanlines of `args.width` bytes.
+    """
+
+    rng = random.Random(0)
+    rows = [
+        bytes(rng.randrange(256) for _ in range(args.width)) for _ in range(args.rows)
+    ]
+
+    for engine, kernels in sorted(png.undo_filter_kernels.items()):
+        for name, fn in zip(["sub", "up", "average", "paeth"], kernels):
+
+            def run():
+                previous = bytearray(args.width)
+                for row in rows:
+                    result = bytearray(row)
+                    fn(args.unit, result, previous, result)
+                    previous = result
+
+            t = timeit(run)
+            mb = args.width * args.rows / 1e6
+            print("unfilter %-8s %-8s %8.3f s %8.2f MB/s" % (engine, name, t, mb / t))
+
+
+def make_image(width, height, mode, bitdepth, rng):
+    """Return the bytes of a random `mode` PNG."""
+
+    planes = len(mode)
+    maxval = 2 ** bitdepth - 1
+    rows = [
+        [rng.randrange(maxval + 1) for _ in range(width * planes)]
+        for _ in range(height)
+    ]
+    w = png.Writer(
+        width,
+        height,
+        greyscale=mode.startswith("L"),
+        alpha=mode.endswith("A"),
+        bitdepth=bitdepth,
+    )
+    out = io.BytesIO()
+    w.write(out, rows)
+    return out.getvalue()
+
+
+def bench_convert(args):
+    """Time the conversion to RGB/RGBA of already decoded pixels,
+    row by row with a fresh or a reused output row, and as one
+    whole-image pass over the flat pixel array.
+    """
+
+    rng = random.Random(0)
+    cases = [
+        ("L", "RGB"),
+        ("L", "RGBA"),
+        ("LA", "RGBA"),
+        ("RGB", "RGBA"),
+    ]
+    for bitdepth in (8, 16):
+        for source, target in cases:
+            data = make_image(args.width, args.height, source, bitdepth, rng)
+            width, height, rows, info = png.Reader(bytes=data).asDirect()
+            rows = list(rows)
+            _, _, flat, _ = png.Reader(bytes=data).read_flat()
+
+            convert = png.make_colour_converter(dict(info), target)
+            n = len(target) * width
+
+            def rows_fresh():
+                for row in png.converted_rows(rows, convert, info, n):
+                    pass
+
+            def rows_reused():
+                for row in png.converted_rows(rows, convert, info, n, reuse=True):
+                    pass
+
+            def whole_image():
+                png.convert_flat(flat, dict(info), target)
+
+            for name, fn in [
+                ("rows", rows_fresh),
+                ("reuse", rows_reused),
+                ("flat", whole_image),
+            ]:
+                t = timeit(fn)
+                mpix = width * height / 1e6
+                print(
+                    "convert %-4s->%-4s %2d-bit %-6s %8.4f s %8.2f Mpixel/s"
+                    % (source, target, bitdepth, name, t, mpix / t)
+                )
+
+
+def make_smooth_rows(width, height, planes, rng):
+    """Return rows of a photograph-like image: gradients plus a little noise."""
+
+    rows = []
+    for y in range(height):
+        row = bytearray(width * planes)
+        for x in range(width):
+            for p in range(planes):
+                v = (x * (p + 1) + y * (3 - p)) // 4 + rng.randrange(4)
+                row[x * planes + p] = v & 0xFF
+        rows.append(row)
+    return rows
+
+
+def bench_filter(args):
+    """Time encoding with each filter strategy,
+    and report the size of the resulting file.
+    """
+
+    rng = random.Random(0)
+    for mode in ("L", "RGB", "RGBA"):
+        planes = len(mode)
+        if args.noise:
+            rows = [
+                bytearray(rng.randrange(256) for _ in range(args.width * planes))
+                for _ in range(args.height)
+            ]
+        else:
+            rows = make_smooth_rows(args.width, args.height, planes, rng)
+        for strategy in png.filter_strategies:
+            if args.workers > 1 and strategy == "brute":
+                continue
+            w = png.Writer(
+                args.width,
+                args.height,
+                greyscale=mode.startswith("L"),
+                alpha=mode.endswith("A"),
+                filter_type=strategy,
+                workers=args.workers,
+            )
+            out = io.BytesIO()
+
+            def run():
+                out.seek(0)
+                out.truncate()
+                w.write(out, rows)
+
+            t = timeit(run)
+            print(
+                "filter %-4s %-5s %8.3f s %10d bytes"
+                % (mode, strategy, t, len(out.getvalue()))
+            )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    unfilter = sub.add_parser("unfilter")
+    unfilter.add_argument("--width", type=int, default=4 * 1000)
+    unfilter.add_argument("--rows", type=int, default=100)
+    unfilter.add_argument("--unit", type=int, default=4)
+    unfilter.set_defaults(func=bench_unfilter)
+
+    convert = sub.add_parser("convert")
+    convert.add_argument("--width", type=int, default=1000)
+    convert.add_argument("--height", type=int, default=200)
+    convert.set_defaults(func=bench_convert)
+
+    filters = sub.add_parser("filter")
+    filters.add_argument("--width", type=int, default=500)
+    filters.add_argument("--height", type=int, default=200)
+    filters.add_argument("--noise", action="store_true")
+    filters.add_argument("--workers", type=int, default=1)
+    filters.set_defaults(func=bench_filter)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    main()
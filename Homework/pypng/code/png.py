@@ -35,9 +35,10 @@
 __version__ = "0.20250521.0"
 
 import collections
-import io
 import itertools
 import math
+import mmap
+import os
 import re
 import struct
 import sys
@@ -48,8 +49,25 @@ import zlib
 
 from array import array
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-__all__ = ["ProtocolError", "Image", "Reader", "Writer", "write_chunks", "from_array"]
+
+__all__ = [
+    "ProtocolError",
+    "Image",
+    "RandomAccessImage",
+    "Reader",
+    "AsyncReader",
+    "IncrementalDecoder",
+    "Writer",
+    "write_chunks",
+    "from_array",
+    "probe",
+    "decode_many",
+]
 
 
 
@@ -79,6 +97,18 @@ def adam7_generate(width, height):
 Resolution = collections.namedtuple("_Resolution", "x y unit_is_meter")
 
 
+def make_unpack_table(bitdepth):
+
+
+    spb = 8 // bitdepth
+    mask = 2 ** bitdepth - 1
+    shifts = [bitdepth * i for i in reversed(range(spb))]
+    return tuple(bytes([mask & (o >> i) for i in shifts]) for o in range(256))
+
+
+unpack_tables = {bitdepth: make_unpack_table(bitdepth) for bitdepth in (1, 2, 4)}
+
+
 def group(s, n):
     return list(zip(*[iter(s)] * n))
 
@@ -184,6 +214,10 @@ class ChunkError(FormatError):
     pass
 
 
+class LimitError(FormatError):
+    pass
+
+
 class Default:
     """"""
 
@@ -208,6 +242,9 @@ class Writer:
         colormap=None,
         maxval=None,
         chunk_limit=2 ** 20,
+        filter_type=0,
+        workers=None,
+        interlace=False,
         physical=tuple(),
         x_pixels_per_unit=None,
         y_pixels_per_unit=None,
@@ -280,6 +317,18 @@ class Writer:
         if bitdepth > 8:
             assert not colormap
 
+        if filter_type not in filter_strategies:
+            raise ProtocolError(
+                " filter_type must be one of %s, not %r"
+                % (", ".join(map(str, filter_strategies)), filter_type)
+            )
+
+        workers = workers or 1
+        if not is_natural(workers) or workers < 1:
+            raise ProtocolError(" workers must be a positive integer, not %r" % workers)
+        if workers > 1 and filter_type == "brute":
+            raise ProtocolError(" brute filter_type cannot be used with workers")
+
         transparent = check_color(transparent, greyscale, "transparent")
         background = check_color(background, greyscale, "background")
 
@@ -309,6 +358,9 @@ class Writer:
         self.bitdepth = int(bitdepth)
         self.compression = compression
         self.chunk_limit = chunk_limit
+        self.filter_type = filter_type
+        self.workers = workers
+        self.interlace = bool(interlace)
         self.palette = palette
         self.x_pixels_per_unit = x_pixels_per_unit
         self.y_pixels_per_unit = y_pixels_per_unit
@@ -344,6 +396,17 @@ class Writer:
                     )
                 yield row
 
+        if self.interlace:
+            fmt = "BH"[self.bitdepth > 8]
+            rows = itertools.islice(check_rows(rows), self.height)
+            a = array(fmt, itertools.chain.from_iterable(rows))
+            if len(a) < vpr * self.height:
+                raise ProtocolError(
+                    " not enough  rows: %d supplied; %d required"
+                    % (len(a) // vpr, self.height)
+                )
+            return self.write_array(outfile, a)
+
         return self.write_passes(outfile, check_rows(rows))
 
     def write_passes(self, outfile, rows):
@@ -366,37 +429,132 @@ class Writer:
 
         self.write_preamble(outfile)
 
+        if self.workers > 1:
+            self.write_idat_parallel(
+                outfile, self.filtered_strips(rows, _COMPRESS_STRIP_BYTES)
+            )
+            write_chunk(outfile, b"IEND")
+            return
+
 
         if self.compression is not None:
             compressor = zlib.compressobj(self.compression)
         else:
             compressor = zlib.compressobj()
 
+        limit = (self.chunk_limit, 0)[self.filter_type == "brute"]
+        compressed = b""
+        for data in self.filtered_strips(rows, limit, compressor):
+            if len(compressed):
+                write_chunk(outfile, b"IDAT", compressed)
+            compressed = compressor.compress(data)
+        compressed += compressor.flush()
+        if len(compressed):
+            write_chunk(outfile, b"IDAT", compressed)
+
+        write_chunk(outfile, b"IEND")
+
+    def filtered_strips(self, rows, limit, compressor=None):
 
-        data = array("B")
 
 
+
+        data = bytearray()
+
+
+        filter_unit = max(1, int(self.psize))
+        if self.interlace:
+            counts = [
+                len(range(y, self.height, ystep))
+                for x, y, xstep, ystep in adam7
+                if x < self.width and y < self.height
+            ]
+        else:
+            counts = [self.height]
+
         irows = iter(rows)
-        for i in range(self.height):
-            try:
-                row = next(irows)
-            except StopIteration:
-                raise ProtocolError(" not enough  rows: %d supplied; %d required" % (i, self.height))
-
-            data.append(0)
-            data.extend(row)
-            if len(data) > self.chunk_limit:
-                compressed = compressor.compress(data)
-                if len(compressed):
-                    write_chunk(outfile, b"IDAT", compressed)
-                data = bytearray()
-
-        compressed = compressor.compress(bytes(data))
-        flushed = compressor.flush()
-        if len(compressed) or len(flushed):
-            write_chunk(outfile, b"IDAT", compressed + flushed)
+        i = 0
+        for count in counts:
+            previous = None
+            for _ in range(count):
+                try:
+                    row = next(irows)
+                except StopIteration:
+                    raise ProtocolError(
+                        " not enough  rows: %d supplied; %d required"
+                        % (i, sum(counts))
+                    )
+                i += 1
+
+                if self.filter_type == 0:
+                    data.append(0)
+                    data.extend(row)
+                else:
+                    row = bytes(row)
+                    if previous is None:
+                        previous = bytes(len(row))
+                    data += self.filter_scanline(row, previous, filter_unit, compressor)
+                    previous = row
+                if len(data) > limit:
+                    yield data
+                    data = bytearray()
+        yield data
+
+    def write_idat_parallel(self, outfile, strips):
+
+
+
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        level = -1 if self.compression is None else self.compression
+        header = zlib_header(level)
+        adler = 1
+        pending = collections.deque()
+
+        def write_next():
+            nonlocal header, adler
+            compressed, strip_adler, length = pending.popleft().result()
+            adler = adler32_combine(adler, strip_adler, length)
+            write_chunk(outfile, b"IDAT", header + compressed)
+            header = b""
+
+        zdict = b""
+        with ThreadPoolExecutor(self.workers) as pool:
+            for strip in strips:
+                if not strip:
+                    continue
+                pending.append(pool.submit(compress_strip, strip, zdict, level))
+                zdict = bytes(strip[-2 ** 15 :])
+                if len(pending) > 2 * self.workers:
+                    write_next()
+            while pending:
+                write_next()
+        write_chunk(outfile, b"IDAT", header + b"\x03\x00" + struct.pack("!I", adler))
+
+    def filter_scanline(self, line, previous, filter_unit, compressor):
+
 
-        write_chunk(outfile, b"IEND")
+
+        strategy = self.filter_type
+        if strategy in (1, 2, 3, 4):
+            kernel = filter_kernels[strategy]
+            return bytes([strategy]) + kernel(filter_unit, line, previous)
+        if strategy == "sum" and (self.colormap or self.bitdepth < 8):
+            return b"\0" + line
+
+        candidates = [
+            bytes([t]) + kernel(filter_unit, line, previous)
+            for t, kernel in enumerate(filter_kernels)
+        ]
+        if strategy == "sum":
+            return min(candidates, key=lambda c: sum(c[1:].translate(signed_abs)))
+
+        def trial_size(candidate):
+            trial = compressor.copy()
+            return len(trial.compress(candidate)) + len(trial.flush(zlib.Z_SYNC_FLUSH))
+
+        return min(candidates, key=trial_size)
 
     def write_preamble(self, outfile):
 
@@ -408,7 +566,7 @@ class Writer:
             raise ProtocolError(" PNG  must be  written to a binary stream") from e
 
 
-        interlace = 0
+        interlace = int(self.interlace)
         write_chunk(
             outfile,
             b"IHDR",
@@ -474,6 +632,8 @@ class Writer:
     def write_array(self, outfile, pixels):
 
 
+        if self.interlace:
+            return self.write_passes(outfile, self.array_scanlines_interlace(pixels))
         return self.write_passes(outfile, self.array_scanlines(pixels))
 
     def array_scanlines(self, pixels):
@@ -487,6 +647,33 @@ class Writer:
             stop = start + vpr
             yield pixels[start:stop]
 
+    def array_scanlines_interlace(self, pixels):
+
+
+
+        fmt = "BH"[self.bitdepth > 8]
+        vpr = self.width * self.planes
+        for x, y, xstep, ystep in adam7:
+            if x >= self.width:
+                continue
+            ppr = (self.width - x + xstep - 1) // xstep
+            for line in range(y, self.height, ystep):
+                offset = line * vpr
+                if xstep == 1:
+                    yield pixels[offset : offset + vpr]
+                    continue
+                row = array(fmt, [0]) * (ppr * self.planes)
+                start = offset + x * self.planes
+                skip = xstep * self.planes
+                for i in range(self.planes):
+                    row[i :: self.planes] = array(
+                        fmt, pixels[start + i : offset + vpr : skip]
+                    )
+                yield row
+
+
+_COMPRESS_STRIP_BYTES = 2 ** 17
+
 
 def write_chunk(outfile, tag, data=b""):
 
@@ -502,6 +689,64 @@ def write_chunk(outfile, tag, data=b""):
     outfile.write(struct.pack("!I", checksum))
 
 
+def zlib_header(level):
+
+
+    if level < 0 or level == 6:
+        flevel = 2
+    else:
+        flevel = (0, 0, 1, 1, 1, 1, 2, 3, 3, 3)[level]
+    cmf = 0x78
+    flg = flevel << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    return bytes([cmf, flg])
+
+
+def adler32_combine(adler1, adler2, length2):
+
+
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    return (sum2 << 16) | sum1
+
+
+def compress_strip(data, zdict, level):
+
+
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(data), len(data)
+
+
+def verify_checksum(tag, data, checksum, crc=None):
+
+
+    if crc is None:
+        crc = zlib.crc32(tag)
+    expected = zlib.crc32(data, crc)
+    expected &= 2 ** 32 - 1
+    (actual,) = struct.unpack("!I", checksum)
+    if actual != expected:
+        raise ChunkError(
+            "checksum error in %s chunk: 0x%08X != 0x%08X."
+            % (tag.decode("ascii"), actual, expected)
+        )
+
+
+def check_limit(what, value, limit):
+
+
+    if limit is not None and value > limit:
+        raise LimitError("%s of %d exceeds the limit of %d." % (what, value, limit))
+
+
 def write_chunks(out, chunks):
 
 
@@ -735,10 +980,194 @@ class Image:
         w.write(file, self.rows)
 
 
+class RandomAccessImage:
+
+
+    def __init__(
+        self, source, strip_rows=64, cache_strips=16, max_checkpoints=64, **kwargs
+    ):
+
+
+
+
+        if strip_rows < 1 or cache_strips < 1 or max_checkpoints < 1:
+            raise ProtocolError(
+                "strip_rows, cache_strips and max_checkpoints must be positive"
+            )
+        self.reader = open_source(source, **kwargs)
+        if not self.reader._seekable():
+            raise ProtocolError("random access needs a seekable source")
+        self.info = self.reader.info()
+        self.width, self.height = self.info["size"]
+        self.strip_rows = strip_rows
+        self.cache_strips = cache_strips
+        self.strips = collections.OrderedDict()
+        self.idat = [
+            (offset + 8, length)
+            for type, offset, length in self.reader.chunk_index
+            if type == b"IDAT"
+        ]
+        self.checkpoints = {0: (0, 0, zlib.decompressobj(), b"", None)}
+        self.max_checkpoints = max_checkpoints
+        self.checkpoint_stride = 1
+        self.all_rows = None
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[y] for y in range(*key.indices(self.height))]
+        y = key + self.height if key < 0 else key
+        if not 0 <= y < self.height:
+            raise IndexError(
+                "row %r out of range for image of height %d" % (key, self.height)
+            )
+        return self._strip(y // self.strip_rows)[y % self.strip_rows][:]
+
+    def rows(self, y0=0, y1=None):
+
+
+
+        if y1 is None:
+            y1 = self.height
+        if not 0 <= y0 <= y1 <= self.height:
+            raise ProtocolError(
+                "rows %r:%r out of range for image of height %d"
+                % (y0, y1, self.height)
+            )
+        n = self.strip_rows
+        result = []
+        for s in range(y0 // n, (y1 + n - 1) // n):
+            strip = self._strip(s)
+            start = max(y0 - s * n, 0)
+            stop = min(y1 - s * n, n)
+            result.extend(row[:] for row in strip[start:stop])
+        return result
+
+    def _strip(self, s):
+        if s in self.strips:
+            self.strips.move_to_end(s)
+            return self.strips[s]
+
+        n = self.strip_rows
+        if self.reader.interlace:
+            if self.all_rows is None:
+                self.all_rows = list(self.reader.read()[2])
+            strip = self.all_rows[s * n : (s + 1) * n]
+        else:
+            strip = self._decode_strip(s)
+
+        self.strips[s] = strip
+        if len(self.strips) > self.cache_strips:
+            self.strips.popitem(last=False)
+        return strip
+
+    def _decode_strip(self, s):
+        r = self.reader
+        n = self.strip_rows
+        k = max(c for c in self.checkpoints if c <= s)
+        i, pos, z, tail, previous = self.checkpoints[k]
+        z = z.copy()
+        tail = bytearray(tail)
+        size = r.row_bytes + 1
+        strip = []
+        for y in range(k * n, min(self.height, (s + 1) * n)):
+            if y % n == 0 and y // n not in self.checkpoints:
+                self._checkpoint(y // n, (i, pos, z.copy(), bytes(tail), previous))
+            while len(tail) < size:
+                if i == len(self.idat):
+                    raise FormatError("wrong  size for decompressed IDAT chunk.")
+                offset, length = self.idat[i]
+                r.file.seek(offset + pos)
+                data = r.file.read(min(length - pos, r.inflate_block))
+                if pos < length and not data:
+                    raise ChunkError("chunk IDAT too short for required octets.")
+                tail += z.decompress(data, r.inflate_block)
+                pos += len(data) - len(z.unconsumed_tail)
+                if pos == length:
+                    i, pos = i + 1, 0
+            line = tail[:size]
+            del tail[:size]
+            previous = bytes(r.undo_filter(line[0], line[1:], previous))
+            if y >= s * n:
+                strip.append(r._bytes_to_values(previous))
+        return strip
+
+    def _checkpoint(self, s, state):
+        if s % self.checkpoint_stride:
+            return
+        self.checkpoints[s] = state
+        while len(self.checkpoints) > self.max_checkpoints:
+            self.checkpoint_stride *= 2
+            self.checkpoints = {
+                c: v
+                for c, v in self.checkpoints.items()
+                if c % self.checkpoint_stride == 0
+            }
+
+
+class BufferFile:
+
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast("B")
+        self.pos = 0
+
+    def read(self, n=-1):
+        start = self.pos
+        end = len(self.view)
+        if n is not None and n >= 0:
+            end = min(end, start + n)
+        self.pos = end
+        return self.view[start:end]
+
+    def seek(self, offset, whence=0):
+        base = (0, self.pos, len(self.view))[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.view.release()
+
+
+def open_mapped(filename):
+
+
+    with open(filename, "rb") as fd:
+        try:
+            return BufferFile(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            pass
+    return open(filename, "rb")
+
+
 class Reader:
 
 
-    def __init__(self, _guess=None, filename=None, file=None, bytes=None):
+    def __init__(
+        self,
+        _guess=None,
+        filename=None,
+        file=None,
+        bytes=None,
+        unfilter="python",
+        check_crc=False,
+        inflate_block=2 ** 16,
+        max_width=None,
+        max_height=None,
+        max_pixels=None,
+        max_chunk_length=None,
+        max_chunks=None,
+        max_inflated=None,
+        max_ancillary=None,
+    ):
 
         keywords_supplied = (
             (_guess is not None)
@@ -754,6 +1183,32 @@ class Reader:
 
         self.atchunk = None
 
+        self.chunk_index = None
+        self.idat_skipped = False
+
+        if unfilter not in undo_filter_kernels:
+            raise ProtocolError(
+                "unfilter must be one of %s" % ", ".join(sorted(undo_filter_kernels))
+            )
+        self.unfilter = unfilter
+        self.check_crc = check_crc
+        if inflate_block < 1:
+            raise ProtocolError(
+                "inflate_block must be positive, not %r" % inflate_block
+            )
+        self.inflate_block = inflate_block
+
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_pixels = max_pixels
+        self.max_chunk_length = max_chunk_length
+        self.max_chunks = max_chunks
+        self.max_inflated = max_inflated
+        self.max_ancillary = max_ancillary
+        self.chunk_count = 0
+        self.ancillary_bytes = 0
+        self.counted_offset = 0
+
         if _guess is not None:
             if isarray(_guess):
                 bytes = _guess
@@ -763,9 +1218,9 @@ class Reader:
                 file = _guess
 
         if bytes is not None:
-            self.file = io.BytesIO(bytes)
+            self.file = BufferFile(bytes)
         elif filename is not None:
-            self.file = open(filename, "rb")
+            self.file = open_mapped(filename)
         elif file is not None:
             self.file = file
         else:
@@ -774,6 +1229,12 @@ class Reader:
     def chunk(self):
 
 
+        type, data = self._read_chunk()
+        return type, bytes(data)
+
+    def _read_chunk(self):
+
+
         self.validate_signature()
 
 
@@ -794,6 +1255,8 @@ class Reader:
         if len(checksum) != 4:
             raise ChunkError("Chunk %s too short for checksum." % type)
 
+        if self.check_crc:
+            verify_checksum(type, data, checksum)
 
         return type, data
 
@@ -811,11 +1274,191 @@ class Reader:
 
         target = bytes(type, "ascii")
 
+        if self.chunk_index is not None and self._seekable():
+            here = self.file.tell() - 8 * bool(self.atchunk)
+            for t, offset, length in self.chunk_index:
+                if t == target and offset >= here:
+                    self._seek_chunk(offset)
+                    return self.chunk()
+            raise ChunkError("no more chunks.")
+
         while True:
             t, v = self.chunk()
             if t == target:
                 return t, v
 
+    def info(self):
+
+
+
+        self.validate_signature()
+        seekable = self._seekable()
+        if seekable:
+            offset = self.file.tell() - 8 * bool(self.atchunk)
+        elif self.chunk_count > bool(self.atchunk):
+            raise ProtocolError(
+                "info() needs a seekable stream once chunks have been read"
+            )
+        else:
+            offset = len(signature)
+
+        index = []
+        first_idat = None
+        while True:
+            if not self.atchunk:
+                self.atchunk = self._chunk_len_type()
+                if self.atchunk is None:
+                    break
+            length, type = self.atchunk
+            index.append((type, offset, length))
+            if type == b"IDAT" and first_idat is None:
+                first_idat = offset
+            offset += length + 12
+            if first_idat is None:
+                self.process_chunk()
+            else:
+                self.atchunk = None
+                self._skip(length + 4)
+            if type == b"IEND":
+                break
+
+        self.chunk_index = index
+        if first_idat is None:
+            raise FormatError("this  PNG file has no IDAT chunks.")
+        if seekable:
+            self._seek_chunk(first_idat)
+        else:
+            self.idat_skipped = True
+        return self._build_info()
+
+    def validate(self):
+
+
+
+        issues = []
+        try:
+            self.validate_signature()
+        except (FormatError, EOFError) as e:
+            return [str(e)]
+
+        d = zlib.decompressobj()
+        decoding = False
+        next_row = expected = inflated = 0
+        bad_filters = 0
+        idat = "none"
+        walked = False
+        first = True
+        while True:
+            try:
+                if not self.atchunk:
+                    self.atchunk = self._chunk_len_type()
+            except FormatError as e:
+                issues.append(str(e))
+                break
+            if self.atchunk is None:
+                issues.append("missing IEND chunk.")
+                walked = True
+                break
+            length, type = self.atchunk
+            self.atchunk = None
+            data = self.file.read(length)
+            checksum = self.file.read(4)
+            if len(data) != length or len(checksum) != 4:
+                issues.append("chunk %s is truncated." % type)
+                break
+            try:
+                verify_checksum(type, data, checksum)
+            except ChunkError as e:
+                issues.append(str(e))
+
+            if first and type != b"IHDR":
+                issues.append("first chunk is %s, not IHDR." % type)
+                break
+            first = False
+
+            if type == b"IDAT":
+                if idat == "done":
+                    issues.append("IDAT chunks are not consecutive.")
+                idat = "open"
+                if not decoding:
+                    continue
+                try:
+                    for block in inflate(d, data, self.inflate_block):
+                        end = inflated + len(block)
+                        while next_row < min(end, expected):
+                            if block[next_row - inflated] > 4:
+                                bad_filters += 1
+                            next_row = next(starts)
+                        inflated = end
+                        if inflated > expected:
+                            break
+                except zlib.error as e:
+                    issues.append("zlib: %s" % e)
+                    decoding = False
+                    continue
+                if inflated > expected:
+                    issues.append("inflated IDAT data exceeds %d bytes." % expected)
+                    decoding = False
+                    continue
+                if d.unused_data:
+                    issues.append("data after end of zlib stream.")
+                    decoding = False
+                continue
+            if idat == "open":
+                idat = "done"
+            if type == b"IEND":
+                walked = True
+                break
+            method = getattr(self, "_process_" + type.decode("ascii"), None)
+            if method is None:
+                continue
+            try:
+                method(bytes(data))
+            except FormatError as e:
+                issues.append(str(e))
+                if type == b"IHDR":
+                    break
+                continue
+            if type == b"IHDR":
+                layout = list(self._pass_layout())
+                expected = sum(nrows * (rb + 1) for *_, rb, nrows in layout)
+                sizes = (rb + 1 for *_, rb, nrows in layout for _ in range(nrows))
+                starts = itertools.accumulate(sizes, initial=0)
+                next_row = next(starts)
+                decoding = True
+
+        if idat == "none":
+            if walked:
+                issues.append("this  PNG file has no IDAT chunks.")
+        elif decoding:
+            if not d.eof:
+                issues.append("zlib stream is truncated.")
+            if inflated != expected:
+                issues.append(
+                    "inflated IDAT data is %d bytes, expected %d." % (inflated, expected)
+                )
+        if bad_filters:
+            issues.append("%d scanlines have an invalid filter type." % bad_filters)
+        return issues
+
+    def _seekable(self):
+        seekable = getattr(self.file, "seekable", None)
+        return bool(seekable and seekable())
+
+    def _seek_chunk(self, offset):
+        self.file.seek(offset)
+        self.atchunk = None
+
+    def _skip(self, n):
+        if self._seekable():
+            self.file.seek(n, 1)
+            return
+        while n > 0:
+            data = self.file.read(min(n, 2 ** 16))
+            if not data:
+                raise ChunkError("chunk too short for required octets.")
+            n -= len(data)
+
     def undo_filter(self, filter_type, scanline, previous):
 
 
@@ -836,69 +1479,123 @@ class Reader:
 
 
         if not previous:
-            previous = bytearray([0] * len(scanline))
+            previous = bytearray(len(scanline))
 
 
-        fn = (
-            None,
-            undo_filter_sub,
-            undo_filter_up,
-            undo_filter_average,
-            undo_filter_paeth,
-        )[filter_type]
+        fn = undo_filter_kernels[self.unfilter][filter_type - 1]
         fn(fu, scanline, previous, result)
         return result
 
     def _deinterlace(self, raw):
 
 
+        return self._deinterlace_blocks([raw])
 
-        vpr = self.width * self.planes
+    def _deinterlace_blocks(self, byte_blocks, a=None, y0=0, y1=None, scale=1):
 
 
-        vpi = vpr * self.height
 
+        vpr = (self.width + scale - 1) // scale * self.planes
 
-        if self.bitdepth > 8:
-            a = array("H", [0] * vpi)
-        else:
-            a = bytearray([0] * vpi)
-        source_offset = 0
+        if y1 is None:
+            y1 = self.height
 
-        for lines in adam7_generate(self.width, self.height):
+        # The image buffer is sized from IHDR, so it is only allocated once
+        # some image data has actually inflated.  Hostile dimensions should
+        # still be refused up front with max_pixels.
+        def allocate():
+            vpi = vpr * ((y1 - y0 + scale - 1) // scale)
+            if self.bitdepth > 8:
+                return array("H", [0]) * vpi
+            return bytearray(vpi)
 
-            recon = None
-            for x, y, xstep in lines:
+        for x, y, xstep, ppr, recon in self._iter_interlaced_packed(byte_blocks):
+            if a is None:
+                a = allocate()
+            if x % scale or y % scale:
 
-                ppr = int(math.ceil((self.width - x) / float(xstep)))
+                break
+            if not y0 <= y < y1:
+                continue
+            x //= scale
+            y = (y - y0) // scale
+            xstep //= scale
 
-                row_size = int(math.ceil(self.psize * ppr))
+            self._put_interlaced(a, vpr, x, y, xstep, ppr, recon)
 
-                filter_type = raw[source_offset]
-                source_offset += 1
-                scanline = raw[source_offset : source_offset + row_size]
-                source_offset += row_size
-                recon = self.undo_filter(filter_type, scanline, recon)
+        if a is None:
+            a = allocate()
+        return a
 
-                flat = self._bytes_to_values(recon, width=ppr)
-                if xstep == 1:
-                    assert x == 0
-                    offset = y * vpr
-                    a[offset : offset + vpr] = flat
-                else:
-                    offset = y * vpr + x * self.planes
-                    end_offset = (y + 1) * vpr
-                    skip = self.planes * xstep
-                    for i in range(self.planes):
-                        a[offset + i : end_offset : skip] = flat[i :: self.planes]
+    def _put_interlaced(self, a, vpr, x, y, xstep, ppr, recon):
 
-        return a
+        flat = self._bytes_to_values(recon, width=ppr)
+        if xstep == 1:
+            assert x == 0
+            offset = y * vpr
+            a[offset : offset + vpr] = flat
+        else:
+            offset = y * vpr + x * self.planes
+            end_offset = (y + 1) * vpr
+            skip = self.planes * xstep
+            for i in range(self.planes):
+                a[offset + i : end_offset : skip] = flat[i :: self.planes]
+
+    def _iter_interlaced_packed(self, byte_blocks):
+
+
+
+        byte_blocks = iter(byte_blocks)
+        passes = list(self._pass_layout())
+        lines = iter_scanlines(
+            byte_blocks,
+            (rb + 1 for *_, rb, nrows in passes for _ in range(nrows)),
+        )
+        for x, y, xstep, ystep, ppr, rb, nrows in passes:
+            n = 0
+            for recon in self._iter_unfilter(itertools.islice(lines, nrows)):
+                yield x, y + n * ystep, xstep, ppr, recon
+                n += 1
+            if n != nrows:
+                raise FormatError("wrong  size for decompressed IDAT chunk.")
+
+        # Read on to IEND, so trailing chunks are still checked.
+        for _ in byte_blocks:
+            pass
+
+    def _iter_bytes_to_values(self, byte_rows, reuse=False):
 
-    def _iter_bytes_to_values(self, byte_rows):
 
+        if not reuse:
+            for row in byte_rows:
+                yield self._bytes_to_values(row)
+            return
 
+        byte_rows = iter(byte_rows)
         for row in byte_rows:
-            yield self._bytes_to_values(row)
+            out = self._bytes_to_values(row)
+            yield out
+            break
+        else:
+            return
+        if self.bitdepth == 16:
+            view = memoryview(out).cast("B")
+            swap = sys.byteorder == "little"
+            for row in byte_rows:
+                view[:] = row
+                if swap:
+                    out.byteswap()
+                yield out
+        elif self.bitdepth == 8:
+            for row in byte_rows:
+                out[:] = row
+                yield out
+        else:
+            table = unpack_tables[self.bitdepth]
+            width = self.width
+            for row in byte_rows:
+                out[:] = bytearray().join(map(table.__getitem__, row))[:width]
+                yield out
 
     def _bytes_to_values(self, bs, width=None):
 
@@ -906,47 +1603,50 @@ class Reader:
         if self.bitdepth == 8:
             return bytearray(bs)
         if self.bitdepth == 16:
-            return array("H", struct.unpack("!%dH" % (len(bs) // 2), bs))
+            a = array("H")
+            a.frombytes(bs)
+            if sys.byteorder == "little":
+                a.byteswap()
+            return a
 
         assert self.bitdepth < 8
         if width is None:
             width = self.width
 
-        spb = 8 // self.bitdepth
-        out = bytearray()
-        mask = 2 ** self.bitdepth - 1
-        shifts = [self.bitdepth * i for i in reversed(range(spb))]
-        for o in bs:
-            out.extend([mask & (o >> i) for i in shifts])
-        return out[:width]
+        table = unpack_tables[self.bitdepth]
+        out = bytearray().join(map(table.__getitem__, bs))
+        del out[width:]
+        return out
 
     def _iter_straight_packed(self, byte_blocks):
 
 
+        lines = iter_scanlines(byte_blocks, itertools.repeat(self.row_bytes + 1))
+        return self._iter_unfilter(lines)
 
-        rb = self.row_bytes
-        a = bytearray()
+    def _iter_unfilter(self, lines):
 
-        recon = None
-        for some_bytes in byte_blocks:
-            a.extend(some_bytes)
-            while len(a) >= rb + 1:
-                filter_type = a[0]
-                scanline = a[1 : rb + 1]
-                del a[: rb + 1]
-                recon = self.undo_filter(filter_type, scanline, recon)
-                yield recon
-        if len(a) != 0:
 
-            raise FormatError("wrong  size for decompressed IDAT chunk.")
-        assert len(a) == 0
+
+        # Rows are unfiltered into two alternating buffers, so a
+        # yielded row is only valid until the next one is produced.
+        previous = current = None
+        for line in lines:
+            if current is None:
+                current = bytearray(line[1:])
+            else:
+                current[:] = line[1:]
+            row = self.undo_filter(line[0], current, previous)
+            current = previous
+            previous = row
+            yield row
 
     def validate_signature(self):
 
 
         if self.signature:
             return
-        self.signature = self.file.read(8)
+        self.signature = bytes(self.file.read(8))
         if len(self.signature) == 0:
             raise EOFError("end of PNG stream.")
         if self.signature != signature:
@@ -955,6 +1655,10 @@ class Reader:
     def preamble(self):
 
 
+        if self.idat_skipped:
+            raise ProtocolError(
+                "image data was skipped by info() on a stream that cannot seek"
+            )
         self.validate_signature()
 
         while True:
@@ -981,6 +1685,22 @@ class Reader:
         type_bytes = set(bytearray(type))
         if not (type_bytes <= set(range(65, 91)) | set(range(97, 123))):
             raise FormatError("chunk %r has invalid Chunk Type." % list(type))
+
+        if self._seekable():
+            offset = self.file.tell() - 8
+            if offset < self.counted_offset:
+                return length, type
+            self.counted_offset = offset + 1
+        self.chunk_count += 1
+        check_limit("chunk count", self.chunk_count, self.max_chunks)
+        check_limit(
+            "%s chunk length" % type.decode("ascii"), length, self.max_chunk_length
+        )
+        if type[0] & 0x20:
+            self.ancillary_bytes += length
+            check_limit(
+                "ancillary chunk data", self.ancillary_bytes, self.max_ancillary
+            )
         return length, type
 
     def process_chunk(self):
@@ -1039,6 +1759,13 @@ class Reader:
             self.psize = int(self.psize)
         self.row_bytes = int(math.ceil(self.width * self.psize))
 
+        check_limit("image width", self.width, self.max_width)
+        check_limit("image height", self.height, self.max_height)
+        check_limit("pixel count", self.width * self.height, self.max_pixels)
+        if self.max_inflated is not None:
+            inflated = sum(nrows * (rb + 1) for *_, rb, nrows in self._pass_layout())
+            check_limit("inflated size", inflated, self.max_inflated)
+
         self.plte = None
 
         self.trns = None
@@ -1113,72 +1840,335 @@ class Reader:
         self.x_pixels_per_unit, self.y_pixels_per_unit, unit = struct.unpack(fmt, data)
         self.unit_is_meter = bool(unit)
 
-    def read(self):
+    def _iter_idat(self):
 
+        while True:
+            type, data = self._read_chunk()
+            if type == b"IEND":
 
-        def iteridat():
+                break
+            if type == b"IFUZZ":
+                arr = [0,1,2]
+                _ = arr[3]
+                break
+            if type != b"IDAT":
+                continue
 
-            while True:
-                type, data = self.chunk()
-                if type == b"IEND":
+            if self.colormap and not self.plte:
+                warnings.warn("PLTE  chunk  is required before IDAT chunk")
+            yield data
 
-                    break
-                if type == b"IFUZZ":
-                    arr = [0,1,2]
-                    _ = arr[3]
-                    break
-                if type != b"IDAT":
-                    continue
+    def _build_info(self):
+
+        info = dict()
+        for attr in "greyscale alpha planes bitdepth".split():
+            info[attr] = getattr(self, attr)
+        info["size"] = (self.width, self.height)
+        for attr in "gamma transparent background".split():
+            a = getattr(self, attr, None)
+            if a is not None:
+                info[attr] = a
+        if getattr(self, "x_pixels_per_unit", None):
+            info["physical"] = Resolution(
+                self.x_pixels_per_unit, self.y_pixels_per_unit, self.unit_is_meter
+            )
+        if self.plte:
+            info["palette"] = self.palette()
+        return info
+
+    def read(self, reuse_buffers=False):
 
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE  chunk  is required before IDAT chunk")
-                yield data
 
         self.preamble()
-        raw = decompress(iteridat())
+        raw = decompress(self._iter_idat(), self.inflate_block, self.max_inflated)
 
         if self.interlace:
 
             def rows_from_interlace():
 
 
-                bs = bytearray(itertools.chain(*raw))
                 arraycode = "BH"[self.bitdepth > 8]
 
-                values = self._deinterlace(bs)
+                values = self._deinterlace_blocks(raw)
                 vpr = self.width * self.planes
+                if reuse_buffers:
+                    row = array(arraycode, values[:vpr])
+                    view = memoryview(row)
+                    with memoryview(values) as source:
+                        for i in range(0, len(values), vpr):
+                            view[:] = source[i : i + vpr]
+                            yield row
+                    return
                 for i in range(0, len(values), vpr):
                     row = array(arraycode, values[i : i + vpr])
                     yield row
 
             rows = rows_from_interlace()
         else:
-            rows = self._iter_bytes_to_values(self._iter_straight_packed(raw))
-        info = dict()
-        for attr in "greyscale alpha planes bitdepth".split():
-            info[attr] = getattr(self, attr)
-        info["size"] = (self.width, self.height)
-        for attr in "gamma transparent background".split():
-            a = getattr(self, attr, None)
-            if a is not None:
-                info[attr] = a
-        if getattr(self, "x_pixels_per_unit", None):
-            info["physical"] = Resolution(
-                self.x_pixels_per_unit, self.y_pixels_per_unit, self.unit_is_meter
+            rows = self._iter_bytes_to_values(
+                self._iter_straight_packed(raw), reuse_buffers
             )
-        if self.plte:
-            info["palette"] = self.palette()
-        return self.width, self.height, rows, info
+        return self.width, self.height, rows, self._build_info()
 
-    def read_flat(self):
+    def read_region(self, y0, y1, x0=0, x1=None):
 
 
-        x, y, pixel, info = self.read()
-        arraycode = "BH"[info["bitdepth"] > 8]
-        pixel = array(arraycode, itertools.chain(*pixel))
-        return x, y, pixel, info
 
-    def palette(self, alpha="natural"):
+        self.preamble()
+        if x1 is None:
+            x1 = self.width
+        if not (0 <= y0 < y1 <= self.height and 0 <= x0 < x1 <= self.width):
+            raise ProtocolError(
+                "region [%r:%r, %r:%r] out of range for %dx%d image"
+                % (y0, y1, x0, x1, self.width, self.height)
+            )
+        info = self._build_info()
+        info["size"] = (x1 - x0, y1 - y0)
+        raw = decompress(self._iter_idat(), self.inflate_block, self.max_inflated)
+
+        if self.interlace:
+
+            def rows_from_interlace():
+                arraycode = "BH"[self.bitdepth > 8]
+                values = self._deinterlace_blocks(raw, None, y0, y1)
+                vpr = self.width * self.planes
+                start = x0 * self.planes
+                stop = x1 * self.planes
+                for i in range(0, len(values), vpr):
+                    yield array(arraycode, values[i + start : i + stop])
+
+            rows = rows_from_interlace()
+        else:
+
+            def rows_from_straight():
+                for y, row in enumerate(self._iter_straight_packed(raw)):
+                    if y < y0:
+                        continue
+                    yield self._bytes_to_values_range(row, x0, x1)
+                    if y + 1 == y1:
+                        return
+                raise FormatError("wrong  size for decompressed IDAT chunk.")
+
+            rows = rows_from_straight()
+        return x1 - x0, y1 - y0, rows, info
+
+    def _bytes_to_values_range(self, bs, x0, x1):
+
+
+        if self.bitdepth >= 8:
+            return self._bytes_to_values(bs[x0 * self.psize : x1 * self.psize])
+        spb = 8 // self.bitdepth
+        skip = x0 % spb
+        values = self._bytes_to_values(
+            bs[x0 // spb : (x1 + spb - 1) // spb], width=skip + x1 - x0
+        )
+        del values[:skip]
+        return values
+
+    def read_preview(self, scale=8):
+
+
+
+        if scale not in (1, 2, 4, 8):
+            raise ProtocolError("scale must be 1, 2, 4 or 8, not %r" % (scale,))
+        self.preamble()
+        width = (self.width + scale - 1) // scale
+        height = (self.height + scale - 1) // scale
+        planes = self.planes
+        info = self._build_info()
+        info["size"] = (width, height)
+        raw = decompress(self._iter_idat(), self.inflate_block, self.max_inflated)
+
+        if self.interlace:
+
+            def rows_from_interlace():
+                arraycode = "BH"[self.bitdepth > 8]
+                values = self._deinterlace_blocks(raw, scale=scale)
+                vpr = width * planes
+                for i in range(0, len(values), vpr):
+                    yield array(arraycode, values[i : i + vpr])
+
+            rows = rows_from_interlace()
+        else:
+
+            def rows_from_straight():
+                for y, row in enumerate(self._iter_straight_packed(raw)):
+                    if y % scale:
+                        continue
+                    values = self._bytes_to_values(row)
+                    out = values[: width * planes]
+                    for i in range(planes):
+                        out[i::planes] = values[i :: planes * scale]
+                    yield out
+
+            rows = rows_from_straight()
+        return width, height, rows, info
+
+    def read_flat(self, mode=None):
+
+
+
+        if mode not in (None, "direct", "RGB", "RGBA"):
+            raise ProtocolError("mode should be None, 'direct', 'RGB' or 'RGBA'")
+        self.preamble()
+        if mode is None or not (self.colormap or self.trns):
+            arraycode = "BH"[self.bitdepth > 8]
+            pixel = array(arraycode, [0]) * (self.width * self.planes * self.height)
+            x, y, pixel, info = self.read_into(pixel)
+        else:
+            x, y, rows, info = self.asDirect()
+            pixel = array("BH"[info["bitdepth"] > 8])
+            for row in rows:
+                pixel.frombytes(memoryview(row).cast("B"))
+
+        if mode in ("RGB", "RGBA"):
+            pixel = convert_flat(pixel, info, mode)
+        return x, y, pixel, info
+
+    def read_into(self, buffer, y0=0, y1=None):
+
+
+
+        self.preamble()
+        if y1 is None:
+            y1 = self.height
+        if not 0 <= y0 < y1 <= self.height:
+            raise ProtocolError(
+                "rows %r:%r out of range for image of height %d"
+                % (y0, y1, self.height)
+            )
+
+        itemsize = 1 + (self.bitdepth > 8)
+        vpr = self.width * self.planes
+        nbytes = (y1 - y0) * vpr * itemsize
+        view = memoryview(buffer)
+        if view.readonly:
+            raise ProtocolError("buffer must be writable")
+        if not view.c_contiguous:
+            raise ProtocolError("buffer must be C-contiguous")
+        if view.itemsize not in (1, itemsize):
+            raise ProtocolError(
+                "buffer item size %d does not match bit depth %d"
+                % (view.itemsize, self.bitdepth)
+            )
+        if view.nbytes < nbytes:
+            raise ProtocolError(
+                "buffer of %d bytes is too small, %d bytes required"
+                % (view.nbytes, nbytes)
+            )
+        view = view.cast("B")[:nbytes]
+
+        raw = decompress(self._iter_idat(), self.inflate_block, self.max_inflated)
+        if self.interlace:
+            target = view.cast("H") if itemsize == 2 else view
+            self._deinterlace_blocks(raw, target, y0, y1)
+            return self.width, self.height, buffer, self._build_info()
+
+        row_size = vpr * itemsize
+        offset = 0
+        for y, row in enumerate(self._iter_straight_packed(raw)):
+            if y < y0:
+                continue
+            if y >= y1:
+                break
+            end = offset + row_size
+            if self.bitdepth < 8:
+                view[offset:end] = self._bytes_to_values(row)
+            elif self.bitdepth == 16 and sys.byteorder == "little":
+                view[offset:end:2] = row[1::2]
+                view[offset + 1 : end : 2] = row[0::2]
+            else:
+                view[offset:end] = row
+            offset = end
+        if offset != nbytes:
+            raise FormatError("wrong  size for decompressed IDAT chunk.")
+        return self.width, self.height, buffer, self._build_info()
+
+    def read_array(self, mode=None):
+
+
+        if numpy is None:
+            raise Error("read_array() requires NumPy")
+        if mode not in (None, "direct", "RGB", "RGBA"):
+            raise ProtocolError("mode should be None, 'direct', 'RGB' or 'RGBA'")
+
+        self.preamble()
+        info = self._build_info()
+
+        passes = list(self._pass_layout())
+        expected = sum(nrows * (rb + 1) for _, _, _, _, _, rb, nrows in passes)
+        raw = numpy.empty(expected, numpy.uint8)
+        n = 0
+        blocks = decompress(self._iter_idat(), self.inflate_block, self.max_inflated)
+        for block in blocks:
+            if n + len(block) > expected:
+                raise FormatError("wrong  size for decompressed IDAT chunk.")
+            raw[n : n + len(block)] = numpy.frombuffer(block, numpy.uint8)
+            n += len(block)
+        if n != expected:
+            raise FormatError("wrong  size for decompressed IDAT chunk.")
+
+        fu = max(1, self.psize)
+        dtype = numpy.uint16 if self.bitdepth > 8 else numpy.uint8
+        if self.interlace:
+            pixels = numpy.zeros((self.height, self.width, self.planes), dtype)
+        offset = 0
+        for x, y, xstep, ystep, ppr, rb, nrows in passes:
+            size = nrows * (rb + 1)
+            values = np_bytes_to_values(
+                np_unfilter(raw[offset : offset + size], nrows, rb, fu),
+                self.bitdepth,
+                ppr * self.planes,
+            ).reshape(nrows, ppr, self.planes)
+            offset += size
+            if self.interlace:
+                pixels[y::ystep, x::xstep] = values
+            else:
+                pixels = values
+        del raw
+
+        if mode is not None:
+            pixels = self._np_direct(pixels, info)
+        if mode in ("RGB", "RGBA"):
+            pixels = np_convert(pixels, info, mode)
+
+        if pixels.shape[2] == 1:
+            pixels = pixels.reshape(self.height, self.width)
+        return self.width, self.height, numpy.ascontiguousarray(pixels), info
+
+    def _pass_layout(self):
+
+        if not self.interlace:
+            yield 0, 0, 1, 1, self.width, self.row_bytes, self.height
+            return
+        for x, y, xstep, ystep in adam7:
+            ppr = (self.width - x + xstep - 1) // xstep
+            nrows = (self.height - y + ystep - 1) // ystep
+            if ppr > 0 and nrows > 0:
+                rb = int(math.ceil(self.psize * ppr))
+                yield x, y, xstep, ystep, ppr, rb, nrows
+
+    def _np_direct(self, pixels, info):
+
+        if self.colormap:
+            info["colormap"] = False
+            info["alpha"] = bool(self.trns)
+            info["bitdepth"] = 8
+            info["planes"] = 3 + bool(self.trns)
+            lut = numpy.array(self.palette(), numpy.uint8)
+            return lut[pixels[..., 0]]
+        if self.trns:
+            maxval = 2 ** info["bitdepth"] - 1
+            info["alpha"] = True
+            info["planes"] += 1
+            del info["transparent"]
+            key = numpy.array(self.transparent, pixels.dtype)
+            opaque = (pixels != key).any(axis=2, keepdims=True)
+            alpha = (opaque * maxval).astype(pixels.dtype)
+            return numpy.concatenate((pixels, alpha), axis=2)
+        return pixels
+
+    def palette(self, alpha="natural"):
 
 
         if not self.plte:
@@ -1190,147 +2180,670 @@ class Reader:
             plte = [pal + (a,) for pal, a in zip(plte, trns)]
         return plte
 
-    def asDirect(self):
+    def asDirect(self, reuse_buffers=False):
         
 
         self.preamble()
 
 
         if not self.colormap and not self.trns and not self.sbit:
-            return self.read()
+            return self.read(reuse_buffers)
 
-        x, y, pixels, info = self.read()
+        x, y, pixels, info = self.read(reuse_buffers)
 
         if self.colormap:
             info["colormap"] = False
             info["alpha"] = bool(self.trns)
             info["bitdepth"] = 8
             info["planes"] = 3 + bool(self.trns)
-            palette = self.palette()
+            entries = palette_table(self.plte, self.trns)
+            planes = info["planes"]
 
             def iterpal(pixels):
+                if not reuse_buffers:
+                    for row in pixels:
+                        yield array("B", b"".join(map(entries.__getitem__, row)))
+                    return
+                tables = [
+                    bytes(entry[c] for entry in entries).ljust(256, b"\0")
+                    for c in range(planes)
+                ]
+                out = result = None
                 for row in pixels:
-                    row = [palette[x] for x in row]
-                    yield array("B", itertools.chain(*row))
+                    index = bytes(row)
+                    if max(index) >= len(entries):
+                        raise IndexError("palette index out of range")
+                    if result is None:
+                        result = bytearray(len(index) * planes)
+                    for c, table in enumerate(tables):
+                        result[c::planes] = index.translate(table)
+                    if out is None:
+                        out = array("B", result)
+                        view = memoryview(out)
+                    else:
+                        view[:] = result
+                    yield out
 
             pixels = iterpal(pixels)
         elif self.trns:
 
-            it = self.transparent
-            maxval = 2 ** info["bitdepth"] - 1
-            planes = info["planes"]
+            convert = make_trns_converter(
+                self.transparent, info["planes"], info["bitdepth"]
+            )
             info["alpha"] = True
             info["planes"] += 1
             del info["transparent"]
-            typecode = "BH"[info["bitdepth"] > 8]
 
             def itertrns(pixels):
+                if not reuse_buffers:
+                    for row in pixels:
+                        yield convert(row)
+                    return
+                out = None
                 for row in pixels:
-
-                    row = group(row, planes)
-                    opa = [maxval * (pix != it) for pix in row]
-                    yield array(
-                        typecode,
-                        itertools.chain(*[pix + (a,) for pix, a in zip(row, opa)]),
-                    )
+                    out = convert(row, out)
+                    yield out
 
             pixels = itertrns(pixels)
 
         return x, y, pixels, info
 
-    def asRGB(self):
+    def asRGB(self, reuse_buffers=False):
 
 
-        width, height, pixels, info = self.asDirect()
-        if info["alpha"]:
-            raise Error("will  not  convert image with alpha channel to RGB")
-        if not info["greyscale"]:
+        width, height, pixels, info = self.asDirect(reuse_buffers)
+        convert = make_colour_converter(info, "RGB")
+        if convert is None:
             return width, height, pixels, info
-        info["greyscale"] = False
-        info["planes"] = 3
+        rows = converted_rows(pixels, convert, dict(info), 3 * width, reuse_buffers)
+        return width, height, rows, info
 
-        if info["bitdepth"] > 8:
+    def asRGBA(self, reuse_buffers=False):
 
-            def newarray():
-                return array("H", [0])
 
-        else:
+        width, height, pixels, info = self.asDirect(reuse_buffers)
+        convert = make_colour_converter(info, "RGBA")
+        if convert is None:
+            return width, height, pixels, info
+        rows = converted_rows(pixels, convert, dict(info), 4 * width, reuse_buffers)
+        return width, height, rows, info
 
-            def newarray():
-                return bytearray([0])
+    def asRGB8(self):
 
-        def iterrgb():
-            for row in pixels:
-                a = newarray() * 3 * width
-                for i in range(3):
-                    a[i::3] = row
-                yield a
 
-        return width, height, iterrgb(), info
+        return self._as_rescale8(self.asRGB)
 
-    def asRGBA(self):
+    def asRGBA8(self):
 
 
-        width, height, pixels, info = self.asDirect()
-        if info["alpha"] and not info["greyscale"]:
+        return self._as_rescale8(self.asRGBA)
+
+    def _as_rescale8(self, get):
+
+        width, height, pixels, info = get()
+        if info["bitdepth"] == 8:
             return width, height, pixels, info
-        typecode = "BH"[info["bitdepth"] > 8]
-        maxval = 2 ** info["bitdepth"] - 1
-        maxbuffer = struct.pack("=" + typecode, maxval) * 4 * width
+        table = rescale_table(info["bitdepth"])
+        info["bitdepth"] = 8
 
-        if info["bitdepth"] > 8:
+        def iterscale():
+            if len(table) == 256:
+                for row in pixels:
+                    yield array("B", bytes(row).translate(table))
+            else:
+                for row in pixels:
+                    yield array("B", bytes(map(table.__getitem__, row)))
+
+        return width, height, iterscale(), info
+
+
+class StreamFile:
+
+
+    def __init__(self, stream, loop):
+        self.stream = stream
+        self.loop = loop
+
+    def read(self, n=-1):
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(self._read(n), self.loop).result()
+
+    async def _read(self, n):
+        if n is None or n < 0:
+            return await self.stream.read()
+        parts = []
+        while n > 0:
+            data = await self.stream.read(n)
+            if not data:
+                break
+            parts.append(data)
+            n -= len(data)
+        return b"".join(parts)
+
+
+class AsyncReader:
+
+
+    def __init__(self, stream, executor=None, batch_bytes=2 ** 18, **kwargs):
+
+
+
+        self.stream = stream
+        self.executor = executor
+        self.batch_bytes = batch_bytes
+        self.kwargs = kwargs
+        self.reader = None
+
+    def __getattr__(self, name):
+        if name == "reader" or self.reader is None:
+            raise AttributeError(name)
+        return getattr(self.reader, name)
+
+    def _open(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self.reader is None:
+            self.reader = Reader(file=StreamFile(self.stream, loop), **self.kwargs)
+        return loop
+
+    async def preamble(self):
+
+
+        loop = self._open()
+        await loop.run_in_executor(self.executor, self.reader.preamble)
+
+    async def chunk(self):
+
+
+        loop = self._open()
+        return await loop.run_in_executor(self.executor, self.reader.chunk)
+
+    async def chunks(self):
+
+
+        while True:
+            t, v = await self.chunk()
+            yield t, v
+            if t == b"IEND":
+                break
+
+    async def read(self):
+
+
+
+        loop = self._open()
+        width, height, rows, info = await loop.run_in_executor(
+            self.executor, self.reader.read
+        )
+        batch = max(1, self.batch_bytes // max(1, self.reader.row_bytes))
+        return width, height, self._iter_batches(loop, rows, batch), info
+
+    async def _iter_batches(self, loop, rows, batch):
+        def take():
+            return list(itertools.islice(rows, batch))
+
+        while True:
+            some = await loop.run_in_executor(self.executor, take)
+            if not some:
+                return
+            for row in some:
+                yield row
+
+
+class FeedFile:
+
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = len(self.data)
+        result = bytes(self.data[:n])
+        del self.data[:n]
+        return result
 
-            def newarray():
-                return array("H", maxbuffer)
 
+class IncrementalDecoder:
+
+
+    def __init__(self, **kwargs):
+
+
+
+        self.file = FeedFile()
+        self.reader = Reader(file=self.file, **kwargs)
+        self.info = None
+        self.remaining = None
+        self.done = False
+
+    def __getattr__(self, name):
+        if name == "reader":
+            raise AttributeError(name)
+        return getattr(self.reader, name)
+
+    def feed(self, data):
+
+
+
+        if self.done:
+            return []
+        self.file.data += data
+        rows = []
+        r = self.reader
+        while True:
+            if r.signature is None:
+                if len(self.file.data) < 8:
+                    break
+                r.validate_signature()
+            if r.atchunk is None:
+                if len(self.file.data) < 8:
+                    break
+                r.atchunk = r._chunk_len_type()
+            length, type = r.atchunk
+            if type == b"IDAT":
+                if self.info is None:
+                    self._start()
+                if self.remaining is None:
+                    self.remaining = length
+                    self.crc = zlib.crc32(type)
+                if self.remaining:
+                    compressed = self.file.read(self.remaining)
+                    self.remaining -= len(compressed)
+                    self.crc = zlib.crc32(compressed, self.crc)
+                    for block in inflate(self.z, compressed, r.inflate_block):
+                        self._inflate(block, rows)
+                if self.remaining or len(self.file.data) < 4:
+                    break
+                checksum = self.file.read(4)
+                if r.check_crc:
+                    verify_checksum(type, b"", checksum, self.crc)
+                r.atchunk = None
+                self.remaining = None
+                continue
+            if len(self.file.data) < length + 4:
+                break
+            if type == b"IEND":
+                r._read_chunk()
+                self.done = True
+                break
+            elif self.info is None:
+                r.process_chunk()
+            else:
+                r._read_chunk()
+        return rows
+
+    def close(self):
+
+
+
+        if self.info is None:
+            raise FormatError("this  PNG file has no IDAT chunks.")
+        if not self.done:
+            raise ChunkError("no more chunks.")
+        rows = []
+        self._inflate(self.z.flush(), rows)
+        if self.inflated != self.expected:
+            raise FormatError("wrong  size for decompressed IDAT chunk.")
+        return rows
+
+    def _start(self):
+        r = self.reader
+        if r.colormap and not r.plte:
+            warnings.warn("PLTE  chunk  is required before IDAT chunk")
+        self.info = r._build_info()
+        self.z = zlib.decompressobj()
+        self.blocks = collections.deque()
+        source = iter(self.blocks.popleft, None)
+
+        passes = list(r._pass_layout())
+        sizes = (rb + 1 for *_, rb, nrows in passes for _ in range(nrows))
+        self.ends = itertools.accumulate(sizes)
+        self.next_end = next(self.ends, None)
+        self.expected = sum(nrows * (rb + 1) for *_, rb, nrows in passes)
+        self.inflated = 0
+        self.y = 0
+
+        if r.interlace:
+            self.lines = r._iter_interlaced_packed(source)
+            self.vpr = r.width * r.planes
+            self.values = None
+            self.final_lines = sum(nrows for *_, nrows in passes[:-1])
+            self.final_ystep = passes[-1][3]
+            self.nlines = 0
         else:
+            self.lines = r._iter_bytes_to_values(r._iter_straight_packed(source))
+
+    def _inflate(self, data, rows):
+        if not data:
+            return
+        self.blocks.append(data)
+        self.inflated += len(data)
+        check_limit("inflated size", self.inflated, self.reader.max_inflated)
+        if self.inflated > self.expected:
+            raise FormatError("wrong  size for decompressed IDAT chunk.")
+        r = self.reader
+        while self.next_end is not None and self.next_end <= self.inflated:
+            self.next_end = next(self.ends, None)
+            if not r.interlace:
+                rows.append(next(self.lines))
+                continue
+
+            x, y, xstep, ppr, recon = next(self.lines)
+            if self.values is None:
+                if r.bitdepth > 8:
+                    self.values = array("H", [0]) * (self.vpr * r.height)
+                else:
+                    self.values = bytearray(self.vpr * r.height)
+            r._put_interlaced(self.values, self.vpr, x, y, xstep, ppr, recon)
+            self.nlines += 1
+            if self.next_end is None:
+                complete = r.height
+            elif self.nlines > self.final_lines:
+                complete = min(r.height, y + self.final_ystep)
+            else:
+                continue
+            arraycode = "BH"[r.bitdepth > 8]
+            for i in range(self.y * self.vpr, complete * self.vpr, self.vpr):
+                rows.append(array(arraycode, self.values[i : i + self.vpr]))
+            self.y = complete
 
-            def newarray():
-                return bytearray(maxbuffer)
 
-        if info["alpha"] and info["greyscale"]:
+def probe(file):
 
-            def convert():
-                for row in pixels:
 
-                    a = newarray()
-                    convert_la_to_rgba(row, a)
-                    yield a
+    r = open_source(file)
+    info = r.info()
+    return info, r.chunk_index
 
-        elif info["greyscale"]:
 
-            def convert():
-                for row in pixels:
-                    a = newarray()
-                    convert_l_to_rgba(row, a)
-                    yield a
+DecodeResult = collections.namedtuple(
+    "DecodeResult", "source width height pixels info error"
+)
+
+decode_modes = {
+    "direct": "asDirect",
+    "RGB": "asRGB",
+    "RGBA": "asRGBA",
+    "RGB8": "asRGB8",
+    "RGBA8": "asRGBA8",
+}
 
+
+def decode_many(sources, workers=None, mode="RGBA8"):
+
+
+
+
+    if mode not in decode_modes:
+        raise ProtocolError(
+            "mode should be one of %s" % ", ".join(sorted(decode_modes))
+        )
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return decode_serial(sources, mode)
+    return decode_pool(sources, workers, mode)
+
+
+def decode_serial(sources, mode):
+
+
+    for source in sources:
+        try:
+            width, height, pixels, info = decode_flat(source, mode)
+        except Exception as e:
+            yield DecodeResult(source, None, None, None, None, e)
         else:
-            assert not info["alpha"] and not info["greyscale"]
+            yield DecodeResult(source, width, height, pixels, info, None)
 
 
-            def convert():
-                for row in pixels:
-                    a = newarray()
-                    convert_rgb_to_rgba(row, a)
-                    yield a
+def decode_pool(sources, workers, mode):
 
-        info["alpha"] = True
-        info["greyscale"] = False
-        info["planes"] = 4
-        return width, height, convert(), info
 
+    from concurrent.futures import Future, ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from multiprocessing import resource_tracker
 
-def decompress(data_blocks):
+    resource_tracker.ensure_running()
+    names = ("png%x_%x" % (os.getpid(), i) for i in itertools.count())
+    pending = collections.deque()
+    sources = iter(sources)
+    pool = ProcessPoolExecutor(workers)
 
+    def submit(source):
+        name = next(names)
+        try:
+            future = pool.submit(decode_shared, source, mode, name)
+        except BrokenProcessPool as e:
+            future = Future()
+            future.set_exception(e)
+        return source, name, future
 
+    def broken(future):
+        return isinstance(future.exception(), BrokenProcessPool)
 
-    d = zlib.decompressobj()
+    def restart(name):
+        nonlocal pool
+        pool.shutdown()
+        release_shared(name)
+        pool = ProcessPoolExecutor(workers)
 
+    try:
+        while True:
+            for source in itertools.islice(sources, 2 * workers - len(pending)):
+                pending.append(submit(source))
+            if not pending:
+                return
+            source, name, future = pending.popleft()
+            if broken(future):
+                # A worker died.  Retry this source on its own, so that a
+                # file which kills its worker is told apart from the others
+                # that were in the pool with it.
+                restart(name)
+                source, name, future = submit(source)
+                if broken(future):
+                    restart(name)
+                for i, (other, other_name, other_future) in enumerate(pending):
+                    if broken(other_future):
+                        release_shared(other_name)
+                        pending[i] = submit(other)
+            try:
+                width, height, name, info = future.result()
+            except Exception as e:
+                yield DecodeResult(source, None, None, None, None, e)
+                continue
+            pixels = collect_shared(name, width, height, info)
+            yield DecodeResult(source, width, height, pixels, info, None)
+    finally:
+        for source, name, future in pending:
+            future.cancel()
+        pool.shutdown()
+        for source, name, future in pending:
+            release_shared(name)
+
+
+def open_source(source, **kwargs):
+
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Reader(bytes=source, **kwargs)
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return Reader(source, **kwargs)
+
+
+def decode_rows(source, mode):
+
+
+    r = open_source(source)
+    return getattr(r, decode_modes[mode])()
+
+
+def decode_flat(source, mode):
+
+
+    width, height, rows, info = decode_rows(source, mode)
+    pixels = array("BH"[info["bitdepth"] > 8])
+    for row in rows:
+        pixels.frombytes(memoryview(row).cast("B"))
+    return width, height, pixels, info
+
+
+def decode_shared(source, mode, name=None):
+
+
+
+    from multiprocessing import shared_memory
+
+    width, height, rows, info = decode_rows(source, mode)
+    nbytes = width * height * info["planes"] * (1 + (info["bitdepth"] > 8))
+    shm = shared_memory.SharedMemory(name, create=True, size=max(nbytes, 1))
+    try:
+        offset = 0
+        for row in rows:
+            row = memoryview(row).cast("B")
+            if offset + len(row) > nbytes:
+                raise FormatError("wrong  size for decompressed IDAT chunk.")
+            shm.buf[offset : offset + len(row)] = row
+            offset += len(row)
+        if offset != nbytes:
+            raise FormatError("wrong  size for decompressed IDAT chunk.")
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return width, height, shm.name, info
+
+
+def collect_shared(name, width, height, info):
+
+
+    from multiprocessing import shared_memory
+
+    itemsize = 1 + (info["bitdepth"] > 8)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pixels = array("BH"[itemsize > 1])
+        pixels.frombytes(shm.buf[: width * height * info["planes"] * itemsize])
+    finally:
+        shm.close()
+        shm.unlink()
+    return pixels
+
+
+def release_shared(name):
+    from multiprocessing import shared_memory
+
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+_rescale_tables = {}
+
+
+def rescale_table(bitdepth):
+
+
+    if bitdepth not in _rescale_tables:
+        maxval = 2 ** bitdepth - 1
+        table = bytes(int(round(v * 255 / maxval)) for v in range(maxval + 1))
+        if bitdepth < 8:
+            table += bytes(256 - len(table))
+        _rescale_tables[bitdepth] = table
+    return _rescale_tables[bitdepth]
+
+
+_palette_tables = {}
+
+
+def palette_table(plte, trns):
+
+
+
+    key = (bytes(plte), bytes(trns or b""))
+    try:
+        return _palette_tables[key]
+    except KeyError:
+        pass
+    plte, trns = key
+    entries = [plte[i : i + 3] for i in range(0, len(plte) - len(plte) % 3, 3)]
+    if trns:
+        alpha = trns[: len(entries)].ljust(len(entries), b"\xff")
+        entries = [rgb + alpha[i : i + 1] for i, rgb in enumerate(entries)]
+    if len(_palette_tables) > 64:
+        _palette_tables.clear()
+    _palette_tables[key] = entries = tuple(entries)
+    return entries
+
+
+def decompress(data_blocks, max_length=2 ** 16, max_total=None):
+
+
+
+    d = zlib.decompressobj()
+    total = 0
     for data in data_blocks:
+        for block in inflate(d, data, max_length):
+            total += len(block)
+            check_limit("inflated size", total, max_total)
+            yield block
+    block = d.flush()
+    check_limit("inflated size", total + len(block), max_total)
+    yield block
+
+
+def inflate(d, data, max_length):
 
-        yield bytearray(d.decompress(data))
-    yield bytearray(d.flush())
+
+
+    while True:
+        block = d.decompress(data, max_length)
+        data = d.unconsumed_tail
+        if block:
+            yield block
+        if not data and len(block) < max_length:
+            return
+
+
+def iter_scanlines(byte_blocks, sizes):
+
+
+
+    sizes = iter(sizes)
+    size = next(sizes, None)
+    pending = bytearray()
+    for some_bytes in byte_blocks:
+        if size is None:
+            return
+        with memoryview(some_bytes) as view:
+            offset = 0
+            while size is not None:
+                if pending:
+                    take = min(size - len(pending), len(view) - offset)
+                    pending += view[offset : offset + take]
+                    offset += take
+                    if len(pending) < size:
+                        break
+                    yield pending
+                    del pending[:]
+                elif offset + size <= len(view):
+                    yield view[offset : offset + size]
+                    offset += size
+                else:
+                    pending += view[offset:]
+                    break
+                size = next(sizes, None)
+    if len(pending) != 0:
+
+        raise FormatError("wrong  size for decompressed IDAT chunk.")
 
 
 def check_bitdepth_colortype(bitdepth, colortype):
@@ -1429,6 +2942,416 @@ def undo_filter_paeth(filter_unit, scanline, previous, result):
         ai += 1
 
 
+_swar_masks = {}
+
+
+def swar_masks(n):
+
+
+    try:
+        return _swar_masks[n]
+    except KeyError:
+        pass
+    if len(_swar_masks) > 64:
+        _swar_masks.clear()
+    high = int.from_bytes(b"\x80" * n, "big")
+    low = int.from_bytes(b"\x7f" * n, "big")
+    _swar_masks[n] = high, low
+    return high, low
+
+
+def swar_add(x, y, high, low):
+    return ((x & low) + (y & low)) ^ ((x ^ y) & high)
+
+
+def undo_filter_sub_fast(filter_unit, scanline, previous, result):
+
+
+
+    n = len(result)
+    high, low = swar_masks(n)
+    r = int.from_bytes(scanline, "big")
+    shift = filter_unit
+    while shift < n:
+        r = swar_add(r, r >> (8 * shift), high, low)
+        shift *= 2
+    result[:] = r.to_bytes(n, "big")
+
+
+def undo_filter_up_fast(filter_unit, scanline, previous, result):
+
+
+    n = len(result)
+    high, low = swar_masks(n)
+    x = int.from_bytes(scanline, "big")
+    b = int.from_bytes(previous, "big")
+    result[:] = swar_add(x, b, high, low).to_bytes(n, "big")
+
+
+def undo_filter_average_fast(filter_unit, scanline, previous, result):
+
+
+
+    for i in range(min(filter_unit, len(result))):
+        out = []
+        append = out.append
+        a = 0
+        for x, b in zip(scanline[i::filter_unit], previous[i::filter_unit]):
+            a = (x + ((a + b) >> 1)) & 0xFF
+            append(a)
+        result[i::filter_unit] = bytes(out)
+
+
+def undo_filter_paeth_fast(filter_unit, scanline, previous, result):
+
+
+
+    if not any(previous):
+        return undo_filter_sub_fast(filter_unit, scanline, previous, result)
+
+    for i in range(min(filter_unit, len(result))):
+        out = []
+        append = out.append
+        a = c = 0
+        for x, b in zip(scanline[i::filter_unit], previous[i::filter_unit]):
+            pa = b - c
+            pb = a - c
+            pc = abs(pa + pb)
+            pa = abs(pa)
+            pb = abs(pb)
+            if pa <= pb and pa <= pc:
+                a = (x + a) & 0xFF
+            elif pb <= pc:
+                a = (x + b) & 0xFF
+            else:
+                a = (x + c) & 0xFF
+            append(a)
+            c = b
+        result[i::filter_unit] = bytes(out)
+
+
+def swar_sub(x, y, high, low):
+    return ((x | high) - (y & low)) ^ ((x ^ ~y) & high)
+
+
+def filter_none(filter_unit, line, previous):
+    return line
+
+
+def filter_sub(filter_unit, line, previous):
+
+    n = len(line)
+    high, low = swar_masks(n)
+    x = int.from_bytes(line, "big")
+    return swar_sub(x, x >> (8 * filter_unit), high, low).to_bytes(n, "big")
+
+
+def filter_up(filter_unit, line, previous):
+
+    n = len(line)
+    high, low = swar_masks(n)
+    x = int.from_bytes(line, "big")
+    b = int.from_bytes(previous, "big")
+    return swar_sub(x, b, high, low).to_bytes(n, "big")
+
+
+def filter_average(filter_unit, line, previous):
+
+    n = len(line)
+    high, low = swar_masks(n)
+    x = int.from_bytes(line, "big")
+    a = x >> (8 * filter_unit)
+    b = int.from_bytes(previous, "big")
+    mean = (a & b) + (((a ^ b) >> 1) & low)
+    return swar_sub(x, mean, high, low).to_bytes(n, "big")
+
+
+def filter_paeth(filter_unit, line, previous):
+
+    pad = bytes(filter_unit)
+    out = bytearray()
+    append = out.append
+    for x, a, b, c in zip(line, pad + line, previous, pad + previous):
+        pa = b - c
+        pb = a - c
+        pc = abs(pa + pb)
+        pa = abs(pa)
+        pb = abs(pb)
+        if pa <= pb and pa <= pc:
+            append((x - a) & 0xFF)
+        elif pb <= pc:
+            append((x - b) & 0xFF)
+        else:
+            append((x - c) & 0xFF)
+    return bytes(out)
+
+
+filter_kernels = (filter_none, filter_sub, filter_up, filter_average, filter_paeth)
+
+filter_strategies = (0, 1, 2, 3, 4, "sum", "brute")
+
+signed_abs = bytes(min(v, 256 - v) for v in range(256))
+
+
+undo_filter_kernels = {
+    "python": (
+        undo_filter_sub,
+        undo_filter_up,
+        undo_filter_average,
+        undo_filter_paeth,
+    ),
+    "fast": (
+        undo_filter_sub_fast,
+        undo_filter_up_fast,
+        undo_filter_average_fast,
+        undo_filter_paeth_fast,
+    ),
+}
+
+
+_WAVEFRONT_ROWS = 64
+
+
+def np_unfilter(raw, nrows, row_bytes, filter_unit):
+
+
+    data = raw.reshape(nrows, row_bytes + 1)
+    types = data[:, 0]
+    if nrows and types.max() > 4:
+        raise FormatError(
+            "invalid PNG Filter Type.  "
+            "See https://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters ."
+        )
+    scan = data[:, 1:]
+    out = numpy.empty((nrows, row_bytes), numpy.uint8)
+    previous = numpy.zeros(row_bytes, numpy.uint8)
+
+    y = 0
+    while y < nrows:
+        filter_type = types[y]
+        if filter_type >= 3:
+            end = y + 1
+            while end < nrows and types[end] >= 3:
+                end += 1
+            if end - y >= _WAVEFRONT_ROWS:
+                np_unfilter_wavefront(
+                    scan[y:end], types[y:end], previous, out[y:end], filter_unit
+                )
+                previous = out[end - 1]
+                y = end
+                continue
+
+        row = out[y]
+        if filter_type == 0:
+            row[:] = scan[y]
+        elif filter_type == 1:
+            numpy.cumsum(
+                scan[y].reshape(-1, filter_unit),
+                axis=0,
+                dtype=numpy.uint8,
+                out=row.reshape(-1, filter_unit),
+            )
+        elif filter_type == 2:
+            numpy.add(scan[y], previous, out=row)
+        else:
+            result = bytearray(scan[y].tobytes())
+            fn = (undo_filter_average, undo_filter_paeth)[filter_type - 3]
+            fn(filter_unit, result, previous.tobytes(), result)
+            row[:] = numpy.frombuffer(result, numpy.uint8)
+        previous = row
+        y += 1
+    return out
+
+
+def np_unfilter_wavefront(scan, types, previous, out, filter_unit):
+
+
+
+    nrows, row_bytes = scan.shape
+    npix = row_bytes // filter_unit
+    x = scan.reshape(nrows, npix, filter_unit).astype(numpy.int16)
+    recon = numpy.zeros((nrows + 1, npix + 1, filter_unit), numpy.int16)
+    recon[0, 1:] = previous.reshape(npix, filter_unit)
+    average = (types == 3)[:, None]
+
+    for t in range(npix + nrows - 1):
+        r = numpy.arange(max(0, t - npix + 1), min(nrows, t + 1))
+        p = t - r
+        a = recon[r + 1, p]
+        b = recon[r, p + 1]
+        c = recon[r, p]
+        pa = numpy.abs(b - c)
+        pb = numpy.abs(a - c)
+        pc = numpy.abs(a + b - 2 * c)
+        pred = numpy.where((pa <= pb) & (pa <= pc), a, numpy.where(pb <= pc, b, c))
+        pred = numpy.where(average[r], (a + b) >> 1, pred)
+        recon[r + 1, p + 1] = (x[r, p] + pred) & 0xFF
+
+    out[:] = recon[1:, 1:].reshape(nrows, row_bytes)
+
+
+def np_bytes_to_values(rows, bitdepth, vpr):
+
+
+    if bitdepth == 8:
+        return rows
+    if bitdepth == 16:
+        return rows.view(">u2").astype(numpy.uint16)
+    if bitdepth == 1:
+        return numpy.unpackbits(rows, axis=1)[:, :vpr]
+    spb = 8 // bitdepth
+    shifts = numpy.arange(8 - bitdepth, -1, -bitdepth, dtype=numpy.uint8)
+    mask = 2 ** bitdepth - 1
+    values = (rows[:, :, None] >> shifts) & mask
+    return values.reshape(len(rows), -1)[:, :vpr]
+
+
+def np_convert(pixels, info, mode):
+
+
+    planes = pixels.shape[2]
+    greyscale = info["greyscale"]
+    alpha = info["alpha"]
+    if mode == "RGB":
+        if alpha:
+            raise Error("will  not  convert image with alpha channel to RGB")
+        if greyscale:
+            pixels = numpy.repeat(pixels, 3, axis=2)
+    elif not (alpha and not greyscale):
+        maxval = 2 ** info["bitdepth"] - 1
+        out = numpy.full(pixels.shape[:2] + (4,), maxval, pixels.dtype)
+        if greyscale:
+            out[..., :3] = pixels[..., :1]
+        else:
+            out[..., :3] = pixels
+        if alpha:
+            out[..., 3] = pixels[..., planes - 1]
+        pixels = out
+    info["greyscale"] = False
+    info["alpha"] = mode == "RGBA"
+    info["planes"] = len(mode)
+    return pixels
+
+
+def make_trns_converter(transparent, planes, bitdepth):
+
+
+
+
+    typecode = "BH"[bitdepth > 8]
+    itemsize = 1 + (bitdepth > 8)
+    maxval = 2 ** bitdepth - 1
+
+    matches = []
+    for value in transparent:
+        if value > maxval:
+            matches = None
+            break
+        key = value.to_bytes(itemsize, sys.byteorder)
+        matches.extend(bytes(v == k for v in range(256)) for k in key)
+    opaque = bytes([maxval & 0xFF]) + bytes(255)
+
+    pixel_bytes = planes * itemsize
+    out_bytes = pixel_bytes + itemsize
+
+    scratch = bytearray(), bytearray()
+
+    def convert(row, out=None):
+        if out is None:
+            data = bytearray(row)
+            result = bytearray(len(data) // pixel_bytes * out_bytes)
+        else:
+            data, result = scratch
+            data[:] = memoryview(row).cast("B")
+            view = memoryview(out).cast("B")
+            if len(result) != len(view):
+                result[:] = view
+        n = len(data) // pixel_bytes
+        for k in range(pixel_bytes):
+            result[k::out_bytes] = data[k::pixel_bytes]
+        if matches is None:
+            alpha = opaque[:1] * n
+        else:
+            hit = -1
+            for k, table in enumerate(matches):
+                hit &= int.from_bytes(data[k::pixel_bytes].translate(table), "big")
+            alpha = hit.to_bytes(n, "big").translate(opaque)
+        for k in range(pixel_bytes, out_bytes):
+            result[k::out_bytes] = alpha
+        if out is None:
+            return array(typecode, result)
+        view[:] = result
+        return out
+
+    return convert
+
+
+def make_colour_converter(info, mode):
+
+
+
+
+    if mode == "RGB":
+        if info["alpha"]:
+            raise Error("will  not  convert image with alpha channel to RGB")
+        convert = (None, convert_l_to_rgb)[info["greyscale"]]
+    elif info["alpha"]:
+        convert = (None, convert_la_to_rgba)[info["greyscale"]]
+    else:
+        convert = (convert_rgb_to_rgba, convert_l_to_rgba)[info["greyscale"]]
+    info["alpha"] = mode == "RGBA"
+    info["greyscale"] = False
+    info["planes"] = len(mode)
+    return convert
+
+
+def colour_template(info, n):
+
+
+    maxval = 2 ** info["bitdepth"] - 1
+    if info["bitdepth"] > 8:
+        return array("H", [maxval]) * n
+    return bytearray([maxval]) * n
+
+
+def converted_rows(rows, convert, info, n, reuse=False):
+
+
+
+    template = result = None
+    for row in rows:
+        if template is None:
+            template = colour_template(info, n)
+        if result is None or not reuse:
+            result = template[:]
+        convert(row, result)
+        yield result
+
+
+def convert_flat(pixels, info, mode):
+
+
+
+
+    n = len(pixels) // info["planes"] * len(mode)
+    convert = make_colour_converter(info, mode)
+    if convert is None:
+        return pixels
+    result = colour_template(info, n)
+    if info["bitdepth"] > 8:
+        convert(pixels, result)
+        return result
+
+    convert(bytearray(pixels), result)
+    return array("B", result)
+
+
+def convert_l_to_rgb(row, result):
+
+    for i in range(3):
+        result[i::3] = row
+
+
 def convert_la_to_rgba(row, result):
     for i in range(3):
         result[i::4] = row[0::2]
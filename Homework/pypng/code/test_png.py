@@ -0,0 +1,79 @@
+import io
+import struct
+import unittest
+import zlib
+
+import png
+
+
+def chunk(type, data):
+    crc = zlib.crc32(type + data)
+    return struct.pack("!I", len(data)) + type + data + struct.pack("!I", crc)
+
+
+def make_png(width, height, raw, interlace=0):
+    ihdr = struct.pack("!2I5B", width, height, 8, 0, 0, 0, interlace)
+    return (
+        png.signature
+        + chunk(b"IHDR", ihdr)
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def long_idat_png():
+    return make_png(1, 1, bytes(10 ** 6))
+
+
+def tall_png(interlace=0):
+    return make_png(1, 2 ** 31 - 1, b"\0\7\0\5", interlace)
+
+
+class LimitTest(unittest.TestCase):
+    def test_inflated_limit_reader(self):
+        r = png.Reader(bytes=long_idat_png(), max_inflated=1000)
+        with self.assertRaises(png.LimitError):
+            list(r.read()[2])
+
+    def test_inflated_limit_incremental(self):
+        decoder = png.IncrementalDecoder(max_inflated=1000)
+        with self.assertRaises(png.LimitError):
+            decoder.feed(long_idat_png())
+
+    def test_chunks_counted_once(self):
+        out = io.BytesIO()
+        png.Writer(2, 2, greyscale=True).write(out, [[0, 1], [2, 3]])
+        data = out.getvalue()
+        r = png.Reader(bytes=data, max_chunks=3)
+        r.info()
+        self.assertEqual(len(list(r.read()[2])), 2)
+        r = png.Reader(bytes=data, max_chunks=2)
+        with self.assertRaises(png.LimitError):
+            list(r.read()[2])
+
+
+class HostileHeaderTest(unittest.TestCase):
+    def test_validate_tall_image(self):
+        for interlace in (0, 1):
+            issues = png.Reader(bytes=tall_png(interlace)).validate()
+            self.assertEqual(
+                issues, ["inflated IDAT data is 4 bytes, expected 4294967294."]
+            )
+
+    def test_feed_tall_image(self):
+        for interlace in (0, 1):
+            decoder = png.IncrementalDecoder()
+            data = make_png(1, 2 ** 31 - 1, b"\0", interlace)
+            self.assertEqual(decoder.feed(data), [])
+            with self.assertRaises(png.FormatError):
+                decoder.close()
+
+    def test_read_wide_image(self):
+        data = make_png(0x59000020, 1, b"\0\1\2\3")
+        for reuse in (False, True):
+            with self.assertRaises(png.FormatError):
+                list(png.Reader(bytes=data).read(reuse_buffers=reuse)[2])
+
+
+if __name__ == "__main__":
+    unittest.main()